@@ -16,6 +16,8 @@ import device
 import general
 import time
 import json
+import array
+import itertools
 import random
 import math
 import arrangement
@@ -32,35 +34,14 @@ from fl_studio_controller.testing.test_suite import TestSuite
 # Constants
 DEBUG = True
 COMMAND_TIMEOUT = 5000 # ms
+COMMAND_TIMEOUT_NS = COMMAND_TIMEOUT * 1000000
+ANIMATION_CYCLE_FRAMES = 120 # frames before the animation repeats
+ANIMATION_FRAME_INTERVAL_NS = 1000000000 // 30 # ~30fps, however often OnIdle runs
+SYSEX_HEADER = b"\xF0\x00\x01" # custom feedback header
+SYSEX_END = b"\xF7"
 
-# Global animation state
-animation_active = False
-animation_frame = 0
-animation_selected_only = False
-animation_type = 0
-animation_start_count = 0
-
-# Step animation state
-step_animation = {
-    "current_frame": 0,
-    "total_frames": 30,
-    "animation_type": 0,
-    "selected_only": False,
-    "channels": []
-}
-
-# Smooth animation state (for auto-running animation)
-smooth_animation = {
-    "is_running": False,
-    "start_time": 0,
-    "frame_delay": 0.1,  # 100ms between frames
-    "current_frame": 0,
-    "total_frames": 30,
-    "end_frame": 30,
-    "animation_type": 0,
-    "selected_only": False,
-    "channels": []
-}
+# Compact separators keep feedback SysEx short; built once instead of per message
+_FEEDBACK_ENCODER = json.JSONEncoder(separators=(",", ":"))
 
 class MCPController:
     
@@ -68,8 +49,42 @@ class MCPController:
         self.command_buffer = []
         self.current_command = None
         self.command_complete = True
-        self.last_command_time = 0
+        self.last_command_ns = 0
         self.response_data = {}
+        self.animation_lut = None
+        self.animation_lut_key = None
+        self.last_animation_ns = 0
+        
+        # Color animation state
+        self.animation_active = False
+        self.animation_running = False # whether OnIdle has started the current run
+        self.animation_frame = 0
+        self.animation_selected_only = False
+        self.animation_type = 0
+        self.animation_start_count = 0
+        
+        # Step animation state
+        self.step_animation = visual_commands.AnimState(
+            current_frame=0,
+            total_frames=30,
+            animation_type=0,
+            selected_only=False,
+            channels=[]
+        )
+        
+        # Smooth animation state (for auto-running animation)
+        self.smooth_animation = visual_commands.AnimState(
+            is_running=False,
+            start_time=0,
+            frame_delay=0.1,  # 100ms between frames
+            current_frame=0,
+            total_frames=30,
+            end_frame=30,
+            animation_type=0,
+            selected_only=False,
+            channels=[]
+        )
+        
         self.log("FL Studio MCP Controller initialized")
         
         # Store state information
@@ -81,17 +96,46 @@ class MCPController:
             "plugin_windows_open": []
         }
 
+        # Command type -> handler taking the command params
+        self.command_handlers = {
+            # ===== CONTENT CREATION COMMANDS =====
+            1: self.cmd_create_notes,
+            8: self.cmd_create_chord_progression,
+            
+            # ===== TRACK AND CHANNEL MANAGEMENT COMMANDS =====
+            2: self.cmd_create_track,
+            3: self.cmd_load_instrument,
+            
+            # ===== TRANSPORT CONTROL COMMANDS =====
+            4: transport_commands.set_tempo,
+            5: transport_commands.cmd_transport_control,
+            6: transport_commands.cmd_select_pattern,
+            
+            # ===== MIXER OPERATION COMMANDS =====
+            7: mixer_commands.cmd_set_mixer_level,
+            
+            # ===== EFFECTS COMMANDS =====
+            9: self.cmd_add_midi_effect,
+            10: mixer_commands.cmd_add_audio_effect,
+            
+            # ===== VISUAL/UI COMMANDS =====
+            11: visual_commands.cmd_randomize_colors,
+            12: self.cmd_get_channel_names,
+            13: self.cmd_get_channel_name
+        }
+
         # Print available ports for debugging
         self.print_ports()
 
-    def log(self, message):
+    def log(self, message, *args):
+        """Print a debug message, %-formatting it with args only when DEBUG is on"""
         if DEBUG:
-            print(f"[MCP] {message}")
+            print("[MCP] " + (message % args if args else message))
 
     def print_ports(self):
         try:
-            self.log(f"Port number: {device.getPortNumber()}")
-            self.log(f"Device name: {device.getName()}")
+            self.log("Port number: %s", device.getPortNumber())
+            self.log("Device name: %s", device.getName())
         except:
             self.log("Could not get device information")
 
@@ -100,90 +144,127 @@ class MCPController:
         try:
             if device.isAssigned():
                 # Convert data to a simple string and send as SysEx
-                message = json.dumps(data)
-                encoded = [ord(c) for c in message]
-                # Create SysEx message with header F0 00 01 (custom header) and end with F7
-                sysex_data = bytearray([0xF0, 0x00, 0x01] + encoded + [0xF7])
-                device.midiOutSysex(bytes(sysex_data))
-                self.log(f"Sent feedback: {message}")
+                # (the encoder escapes non-ASCII, so every byte stays below 0x80)
+                message = _FEEDBACK_ENCODER.encode(data)
+                device.midiOutSysex(SYSEX_HEADER + message.encode("ascii") + SYSEX_END)
+                self.log("Sent feedback: %s", message)
         except Exception as e:
-            self.log(f"Error sending feedback: {str(e)}")
+            self.log("Error sending feedback: %s", e)
+    
+    def build_animation_lut(self, anim_type, total_channels):
+        """Compute the colors of every frame of one animation cycle
+        
+        Args:
+            anim_type (int): 0=rainbow, 1=pulse, anything else=wave
+            total_channels (int): Number of channels in the channel rack
+            
+        Returns:
+            array.array: Packed colors, frame by frame; frame f's row
+                         starts at f * total_channels
+        """
+        # Each type has its own builder, so the frame loop never checks the type
+        builders = {0: self.build_rainbow_lut, 1: self.build_pulse_lut}
+        build = builders.get(anim_type, self.build_wave_lut)
+        offsets = visual_commands.channel_positions(total_channels)
+        lut = array.array('I')
+        build(lut, offsets)
+        return lut
+    
+    def build_rainbow_lut(self, lut, offsets):
+        """Rainbow gradient that shifts over time"""
+        to_packed = visual_commands.hsv_to_packed
+        for frame in range(ANIMATION_CYCLE_FRAMES):
+            frame_progress = frame / ANIMATION_CYCLE_FRAMES
+            lut.extend([to_packed((offset + frame_progress) % 1.0, 0.8, 0.9) for offset in offsets])
+    
+    def build_pulse_lut(self, lut, offsets):
+        """Pulsing intensity synchronized across channels, each channel has a fixed color"""
+        to_packed = visual_commands.hsv_to_packed
+        sin = math.sin
+        two_pi = 2 * math.pi
+        for frame in range(ANIMATION_CYCLE_FRAMES):
+            frame_progress = frame / ANIMATION_CYCLE_FRAMES
+            value = 0.4 + 0.6 * (0.5 + 0.5 * sin(frame_progress * two_pi))
+            lut.extend([to_packed(offset, 0.9, value) for offset in offsets])
+    
+    def build_wave_lut(self, lut, offsets):
+        """Wave pattern moving through channels"""
+        to_packed = visual_commands.hsv_to_packed
+        sin = math.sin
+        two_pi = 2 * math.pi
+        
+        # Per-channel offsets are the same for every frame
+        wave_offsets = [(offset * 4, offset * 0.2) for offset in offsets]
+        
+        for frame in range(ANIMATION_CYCLE_FRAMES):
+            frame_progress = frame / ANIMATION_CYCLE_FRAMES
+            
+            # The frame's shifts are the same for every channel
+            phase_shift = frame_progress * 2
+            hue_shift = frame_progress * 0.1
+            for phase_offset, hue_offset in wave_offsets:
+                phase = (phase_offset + phase_shift) % 1.0
+                intensity = 0.5 + 0.5 * sin(phase * two_pi)
+                hue = (hue_offset + hue_shift) % 1.0
+                lut.append(to_packed(hue, 0.7 + 0.3 * intensity, 0.9))
     
     def update_animation_frame(self):
         """Update one frame of the color animation"""
-        global animation_frame, animation_active, animation_type, animation_selected_only, animation_start_count
-        
         try:
-            if not animation_active:
+            if not self.animation_active:
                 return
             
-            # Get channel count
-            total_channels = channels.channelCount()
+            # Get channel count (cached briefly, so most frames skip the host call)
+            total_channels = visual_commands.get_channel_count()
             if total_channels == 0:
                 return
             
             # Increment frame counter
-            animation_frame += 1
+            animation_frame = self.animation_frame + 1
+            self.animation_frame = animation_frame
             
             # Stop after ~60 seconds (at ~30fps this would be 1800 frames)
-            if animation_start_count > 0 and animation_frame > 1800:
+            if self.animation_start_count > 0 and animation_frame > 1800:
                 self.log("Animation completed - maximum frames reached")
-                animation_active = False
+                self.animation_active = False
                 return
                 
-            # Animation parameters
-            frame_progress = (animation_frame % 120) / 120.0  # Cycle every 120 frames
+            # The animation repeats every ANIMATION_CYCLE_FRAMES frames, so its
+            # colors are computed once per type and channel count
+            animation_type = self.animation_type
+            lut_key = (animation_type, total_channels)
+            if self.animation_lut_key != lut_key:
+                self.animation_lut = self.build_animation_lut(animation_type, total_channels)
+                self.animation_lut_key = lut_key
             
-            for i in range(total_channels):
-                # Check if we should process this channel
-                if animation_selected_only and not channels.isChannelSelected(i):
-                    continue
-                
-                # Generate color based on animation type
-                if animation_type == 0:  # Rainbow
-                    # Rainbow gradient that shifts over time
-                    hue = (i / total_channels + frame_progress) % 1.0
-                    r, g, b = visual_commands.hsv_to_rgb(hue, 0.8, 0.9)
-                    
-                elif animation_type == 1:  # Pulse
-                    # Pulsing intensity synchronized across channels
-                    intensity = 0.5 + 0.5 * math.sin(frame_progress * 2 * math.pi)
-                    base_hue = (i / total_channels) % 1.0  # Each channel has a fixed color
-                    r, g, b = visual_commands.hsv_to_rgb(base_hue, 0.9, 0.4 + 0.6 * intensity)
-                    
-                else:  # Wave or other - default to wave pattern
-                    # Wave pattern moving through channels
-                    phase = (i / total_channels * 4 + frame_progress * 2) % 1.0
-                    intensity = 0.5 + 0.5 * math.sin(phase * 2 * math.pi)
-                    hue = (i / total_channels * 0.2 + frame_progress * 0.1) % 1.0
-                    r, g, b = visual_commands.hsv_to_rgb(hue, 0.7 + 0.3 * intensity, 0.9)
-                
-                # Scale to 0-255 range
-                r = int(r * 255)
-                g = int(g * 255)
-                b = int(b * 255)
-                
-                # Convert to FL Studio color format (0xBBGGRR)
-                color = (b << 16) | (g << 8) | r
-                
-                # Set the channel color
-                channels.setChannelColor(i, color)
+            # Unpack this frame's row into Python ints in one go
+            base = (animation_frame % ANIMATION_CYCLE_FRAMES) * total_channels
+            row = self.animation_lut[base:base + total_channels].tolist()
+            
+            # Set the channel colors from this frame's row
+            if self.animation_selected_only:
+                # Use the shared selection mask instead of querying every channel each frame,
+                # and only touch the selected channels
+                selected = list(itertools.compress(range(total_channels), visual_commands.get_selection_mask()))
+                visual_commands.apply_colors(selected, [row[i] for i in selected])
+            else:
+                visual_commands.apply_colors(range(len(row)), row)
             
         except Exception as e:
-            self.log(f"Error updating animation: {str(e)}")
-            animation_active = False
+            self.log("Error updating animation: %s", e)
+            self.animation_active = False
 
     def OnMidiMsg(self, event):
         # Log incoming MIDI message if in debug mode
         if DEBUG:
-            self.log(f"MIDI: id={event.midiId}, data1={event.data1}, data2={event.data2}")
+            self.log("MIDI: id=%s, data1=%s, data2=%s", event.midiId, event.data1, event.data2)
 
         # Handle regular note input directly
         if event.midiId == midi.MIDI_NOTEON:
             if event.data2 > 0: # Note on with velocity > 0
                 index = channels.selectedChannel()
                 channels.midiNoteOn(index, event.data1, event.data2)
-                self.log(f"Playing note {event.data1} with velocity {event.data2} on channel {index}")
+                self.log("Playing note %s with velocity %s on channel %s", event.data1, event.data2, index)
                 return True
             else: # Note on with velocity 0 is a note off
                 channels.midiNoteOn(channels.selectedChannel(), event.data1, 0)
@@ -197,13 +278,13 @@ class MCPController:
             # Check for command start marker (CC 120)
             if event.data1 == 120:
                 # Start a new command
-                self.last_command_time = time.time() * 1000  # using time.time() instead of general.getTime()
+                self.last_command_ns = time.monotonic_ns()
                 self.current_command = {
                     "type": event.data2,
                     "params": {}
                 }
                 self.command_complete = False
-                self.log(f"Command start: type={event.data2}")
+                self.log("Command start: type=%s", event.data2)
                 return True
 
             # Check for parameters (CC 121-125)
@@ -213,13 +294,13 @@ class MCPController:
                 if param_index < len(param_names) and self.current_command is not None:
                     param_name = param_names[param_index]
                     self.current_command["params"][param_name] = event.data2
-                    self.log(f"Command param: {param_name}={event.data2}")
+                    self.log("Command param: %s=%s", param_name, event.data2)
                     return True
 
             # Check for command end marker (CC 126)
             elif event.data1 == 126 and not self.command_complete:
                 self.command_complete = True
-                self.log(f"Command complete: {self.current_command}")
+                self.log("Command complete: %s", self.current_command)
                 # Process the command immediately
                 try:
                     result = self.process_command(self.current_command) 
@@ -227,7 +308,7 @@ class MCPController:
                     if result:
                         self.send_feedback({"status": "success", "result": result})
                 except Exception as e:
-                    self.log(f"Error processing command: {str(e)}")
+                    self.log("Error processing command: %s", e)
                     self.send_feedback({"status": "error", "message": str(e)})
                 return True
 
@@ -251,89 +332,92 @@ class MCPController:
         params = command["params"]
 
         # Store the last command for debugging
-        self.log(f"Processing command type {cmd_type} with params {params}")
+        self.log("Processing command type %s with params %s", cmd_type, params)
 
-        # ===== CONTENT CREATION COMMANDS =====
-        if cmd_type == 1: # Create or clear notes
-            return channel_commands.cmd_create_notes(params, self.log, self.state)
-        elif cmd_type == 8: # Create chord progression
-            return channel_commands.cmd_create_chord_progression(params, self.log)
-            
-        # ===== TRACK AND CHANNEL MANAGEMENT COMMANDS =====
-        elif cmd_type == 2: # Create track
-            # Note: Not implemented yet
-            return {"error": "Create track command not implemented"}
-        elif cmd_type == 3: # Load instrument
-            # Note: Not implemented yet
-            return {"error": "Load instrument command not implemented"}
-            
-        # ===== TRANSPORT CONTROL COMMANDS =====
-        elif cmd_type == 4: # Set tempo
-            return transport_commands.set_tempo(params)
-        elif cmd_type == 5: # Transport control (play, stop, record)
-            return transport_commands.cmd_transport_control(params)
-        elif cmd_type == 6: # Select pattern
-            return transport_commands.cmd_select_pattern(params)
-            
-        # ===== MIXER OPERATION COMMANDS =====
-        elif cmd_type == 7: # Set mixer level
-            return mixer_commands.cmd_set_mixer_level(params)
-            
-        # ===== EFFECTS COMMANDS =====
-        elif cmd_type == 9: # Add MIDI effect
-            # Note: Not implemented yet
-            return {"error": "Add MIDI effect command not implemented"}
-        elif cmd_type == 10: # Add audio effect
-            return mixer_commands.cmd_add_audio_effect(params)
-
-        # ===== VISUAL/UI COMMANDS =====
-        elif cmd_type == 11: # Randomize channel colors
-            return visual_commands.cmd_randomize_colors(params)
-        elif cmd_type == 12: # Get all channel names
-            try:
-                names = []
-                count = channels.channelCount() # Use the *real* FL API
-                for i in range(count):
-                    # Use the function from channel_commands or call FL API directly
-                    names.append(channel_commands.get_channel_name(i)) 
-                    # Or directly: names.append(channels.getChannelName(i))
-                self.log(f"Sending channel names: {names}")
-                # Use send_feedback to send data back via SysEx
-                return {"status": "success", "names": names} 
-            except Exception as e:
-                self.log(f"Error getting channel names: {str(e)}")
-                return {"status": "error", "message": str(e)}
-        elif cmd_type == 13: # Get specific channel name (example)
-            try:
-                index = params.get("track", -1) 
-                if 0 <= index < channels.channelCount():
-                    name = channel_commands.get_channel_name(index)
-                    # Or directly: name = channels.getChannelName(index)
-                    self.log(f"Sending channel name for index {index}: {name}")
-                    return {"status": "success", "index": index, "name": name}
-                else:
-                    return {"status": "error", "message": f"Invalid channel index: {index}"}
-            except Exception as e:
-                self.log(f"Error getting channel name for index {params.get('track', -1)}: {str(e)}")
-                return {"status": "error", "message": str(e)}
-        else:
-            self.log(f"Unknown command type: {cmd_type}")
+        handler = self.command_handlers.get(cmd_type)
+        if handler is None:
+            self.log("Unknown command type: %s", cmd_type)
             return {"error": f"Unknown command type: {cmd_type}"}
+        return handler(params)
+
+    def cmd_create_notes(self, params):
+        """Create or clear notes"""
+        return channel_commands.cmd_create_notes(params, self.log, self.state)
+
+    def cmd_create_chord_progression(self, params):
+        """Create chord progression"""
+        return channel_commands.cmd_create_chord_progression(params, self.log)
+
+    def cmd_create_track(self, params):
+        # Note: Not implemented yet
+        return {"error": "Create track command not implemented"}
+
+    def cmd_load_instrument(self, params):
+        # Note: Not implemented yet
+        return {"error": "Load instrument command not implemented"}
+
+    def cmd_add_midi_effect(self, params):
+        # Note: Not implemented yet
+        return {"error": "Add MIDI effect command not implemented"}
+
+    def cmd_get_channel_names(self, params):
+        """Get all channel names"""
+        try:
+            names = []
+            count = channels.channelCount() # Use the *real* FL API
+            for i in range(count):
+                # Use the function from channel_commands or call FL API directly
+                names.append(channel_commands.get_channel_name(i)) 
+                # Or directly: names.append(channels.getChannelName(i))
+            self.log("Sending channel names: %s", names)
+            # Use send_feedback to send data back via SysEx
+            return {"status": "success", "names": names} 
+        except Exception as e:
+            self.log("Error getting channel names: %s", e)
+            return {"status": "error", "message": str(e)}
+
+    def cmd_get_channel_name(self, params):
+        """Get specific channel name (example)"""
+        try:
+            index = params.get("track", -1) 
+            if 0 <= index < channels.channelCount():
+                name = channel_commands.get_channel_name(index)
+                # Or directly: name = channels.getChannelName(index)
+                self.log("Sending channel name for index %s: %s", index, name)
+                return {"status": "success", "index": index, "name": name}
+            else:
+                return {"status": "error", "message": f"Invalid channel index: {index}"}
+        except Exception as e:
+            self.log("Error getting channel name for index %s: %s", params.get('track', -1), e)
+            return {"status": "error", "message": str(e)}
 
     def OnIdle(self):
         """Called periodically"""
         # Check for command timeout
         if not self.command_complete and self.current_command is not None:
-            current_time = time.time() * 1000  # using time.time() instead of general.getTime()
-            if current_time - self.last_command_time > COMMAND_TIMEOUT:
-                self.log(f"Command timeout: {self.current_command}")
+            if time.monotonic_ns() - self.last_command_ns > COMMAND_TIMEOUT_NS:
+                self.log("Command timeout: %s", self.current_command)
                 self.command_complete = True
                 self.current_command = None
                 
         # Update animation if active
-        global animation_active
-        if animation_active:
-            self.update_animation_frame()
+        if self.animation_active:
+            # A new run starts from the channels' current colors
+            if not self.animation_running:
+                visual_commands.invalidate_color_cache()
+                self.animation_running = True
+            
+            # Idle ticks between frames do nothing
+            now = time.monotonic_ns()
+            if now - self.last_animation_ns >= ANIMATION_FRAME_INTERVAL_NS:
+                self.last_animation_ns = now
+                self.update_animation_frame()
+        else:
+            self.animation_running = False
+        
+        # Advance the smooth animation started by RunSmoothAnimation
+        if self.smooth_animation.is_running:
+            visual_commands.tick_animation(self.smooth_animation)
 
 # Global instance
 flMCPController = None
@@ -366,6 +450,22 @@ def OnIdle():
         flMCPController.OnIdle()
     return True
 
+def OnRefresh(flags):
+    """Called when something changed in FL Studio that the script may need to update"""
+    # Channel names feed the color-by-type cache
+    if flags & midi.HW_Dirty_Names:
+        visual_commands.invalidate_name_cache()
+    # Switching channel rack groups changes which channel each index points at
+    if flags & midi.HW_Dirty_ChannelRackGroup:
+        visual_commands.invalidate_color_cache()
+    return
+
+def OnProjectLoad(status):
+    """Called when a project starts loading, finishes loading or fails to load"""
+    # Channel colors written for the previous project no longer apply
+    visual_commands.invalidate_color_cache()
+    return
+
 def OnTransport(isPlaying):
     """Called when the transport state changes (play/stop)"""
     print(f"Transport state changed: {'Playing' if isPlaying else 'Stopped'}")
@@ -387,23 +487,42 @@ def RandomizeSelectedChannelColors():
 
 def AnimationSetup(animation_type=0, selected_only=False, total_frames=30):
     """Set up a step-by-step animation that can be manually advanced"""
-    return visual_commands.animation_setup(animation_type, selected_only, total_frames)
+    return visual_commands.animation_setup(animation_type, selected_only, total_frames, _store_step_animation)
 
-def NextAnimationFrame(animation_state):
-    """Render the next frame of the step animation"""
+def _store_step_animation(animation_state):
+    """Keep a new step animation on the controller for NextAnimationFrame"""
+    if flMCPController:
+        flMCPController.step_animation = animation_state
+
+def NextAnimationFrame(animation_state=None):
+    """Render the next frame of the step animation (the last one set up by default)"""
+    if animation_state is None:
+        if not flMCPController:
+            return {"success": False, "message": "No animation setup."}
+        animation_state = flMCPController.step_animation
     return visual_commands.next_animation_frame(animation_state)
 
 def RunSmoothAnimation(animation_type=0, selected_only=False, duration_seconds=5, frames_per_second=10):
     """Start a smooth animation that runs for the specified duration"""
-    result = visual_commands.run_smooth_animation(animation_type, selected_only, duration_seconds, frames_per_second)
+    result = visual_commands.run_smooth_animation(
+        animation_type, selected_only, duration_seconds, frames_per_second, _store_smooth_animation
+    )
     
-    # In the real implementation, we would need to add a timer mechanism to 
-    # call render_animation_frame repeatedly, but that's UI framework specific
+    # Frames are rendered from OnIdle until the animation ends or is stopped
     
     return result
 
-def StopSmoothAnimation(animation_state):
-    """Stop any running animation"""
+def _store_smooth_animation(animation_state):
+    """Keep a new smooth animation on the controller so OnIdle can drive it"""
+    if flMCPController:
+        flMCPController.smooth_animation = animation_state
+
+def StopSmoothAnimation(animation_state=None):
+    """Stop any running animation (the last one started by default)"""
+    if animation_state is None:
+        if not flMCPController:
+            return {"success": False, "message": "No animation was running"}
+        animation_state = flMCPController.smooth_animation
     return visual_commands.stop_animation(animation_state)
 
 # Preset effects
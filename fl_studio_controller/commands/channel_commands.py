@@ -7,6 +7,8 @@ import time
 import random
 import math
 
+from fl_studio_controller.commands import visual_commands
+
 # test / not sure if working
 def cmd_create_notes(params, log_func, state):
     """Create or clear notes in the selected channel"""
@@ -67,12 +69,8 @@ def getAllSelectedChannelIndices():
     Returns:
         list[int]: A list of group-relative indices.
     """
-    selected_indices = []
     count = channels.channelCount(False) 
-    for i in range(count):
-        if channels.isChannelSelected(i, useGlobalIndex=False):
-            selected_indices.append(i)
-    return selected_indices
+    return [i for i in range(count) if channels.isChannelSelected(i, useGlobalIndex=False)]
 
 # working channel_commands.getChannelCount()
 def getChannelCount():
@@ -166,6 +164,8 @@ def getChannelColor(index):
 def setChannelColor(index, color):
     """Sets the color of the channel at the group index (0xBBGGRR)."""
     channels.setChannelColor(index, color, useGlobalIndex=False)
+    # The visual effects' record of written colors no longer matches this channel
+    visual_commands.invalidate_color_cache()
 
 def getSelectedChannelColor():
     """Gets the color of the first selected channel."""
@@ -23,6 +23,31 @@ def cmd_set_mixer_level(params):
         print(f"Error in set_mixer_level: {str(e)}")
         return {"error": str(e)}
 
+# Map effect type to FL Studio plugin
+_EFFECT_MAP = {
+    1: "Fruity Reverb 2",
+    2: "Fruity Delay 3",
+    3: "Fruity Parametric EQ 2",
+    4: "Fruity Compressor",
+    0: "Fruity Limiter"
+}
+
+# Plugin indices found so far; the plugin database doesn't change during a session
+_plugin_cache = {}
+
+def _find_plugin(name):
+    """Find a plugin's index by name, remembering successful lookups
+    
+    Returns:
+        int: Plugin index, or -1 if not found (misses aren't cached)
+    """
+    plugin_index = _plugin_cache.get(name)
+    if plugin_index is None:
+        plugin_index = plugins.find(name)
+        if plugin_index != -1:
+            _plugin_cache[name] = plugin_index
+    return plugin_index
+
 def cmd_add_audio_effect(params):
     """Add an audio effect to a mixer track"""
     try:
@@ -30,48 +55,27 @@ def cmd_add_audio_effect(params):
         track = params.get("track", 0)
         effect_type = params.get("instrument", 0)
 
-        # Map effect type to FL Studio plugin
-        effect_map = {
-            1: "Fruity Reverb 2",
-            2: "Fruity Delay 3",
-            3: "Fruity Parametric EQ 2",
-            4: "Fruity Compressor",
-            0: "Fruity Limiter"
-        }
-
         # Get the effect name
-        effect_name = effect_map.get(effect_type, "Fruity Limiter")
-
-        # Find first empty slot
-        slot = 0
-        while slot < 10 and mixer.isTrackPluginValid(track, slot):
-            slot += 1
+        effect_name = _EFFECT_MAP.get(effect_type, "Fruity Limiter")
 
-        if slot >= 10:
-            return {"error": "No empty effect slots available"}
+        # Find the first empty slot (max 10 slots)
+        slot_index = next((i for i in range(10) if mixer.getTrackPluginId(track, i) == 0), -1)
+        if slot_index == -1:
+            return {"error": "No free effect slots on this track"}
 
         # Find the plugin index
-        plugin_index = plugins.find(effect_name)  
+        plugin_index = _find_plugin(effect_name)  
         if plugin_index == -1:
             print(f"Effect '{effect_name}' not found.")
             # Try finding a default reverb or delay
-            plugin_index = plugins.find("Fruity Reeverb 2")  
+            plugin_index = _find_plugin("Fruity Reeverb 2")  
             if plugin_index == -1:
-                plugin_index = plugins.find("Fruity Delay 3")  
+                plugin_index = _find_plugin("Fruity Delay 3")  
                 if plugin_index == -1:
                     return {"error": f"Could not find effect '{effect_name}' or default effects"}
             effect_name = plugins.getPluginName(plugin_index)
 
         # Add the effect to the first available slot
-        slot_index = -1
-        for i in range(10): # Max 10 slots
-            if mixer.getTrackPluginId(track, i) == 0:
-                slot_index = i
-                break
-        
-        if slot_index == -1:
-            return {"error": "No free effect slots on this track"}
-
         mixer.trackPluginLoad(track, slot_index, plugin_index)  
 
         return {"success": True, "track": track, "effect": effect_name, "slot": slot_index}
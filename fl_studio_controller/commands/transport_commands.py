@@ -122,30 +122,46 @@ def get_main_volume():
         print(f"Error getting main volume: {str(e)}")
         return 0.0  # Default fallback
 
+def _transport_play():
+    transport.start()
+    return {"success": True, "action": "play"}
+
+def _transport_stop():
+    transport.stop()
+    return {"success": True, "action": "stop"}
+
+def _transport_record():
+    transport.record()
+    return {"success": True, "action": "record"}
+
+# Toggle resolves to stop/play based on the current playing state
+_TRANSPORT_TOGGLE = {True: _transport_stop, False: _transport_play}
+
+def _transport_toggle():
+    return _TRANSPORT_TOGGLE[bool(transport.isPlaying())]()
+
+# 0=play, 1=stop, 2=record, 3=toggle
+_TRANSPORT_ACTIONS = {
+    0: _transport_play,
+    1: _transport_stop,
+    2: _transport_record,
+    3: _transport_toggle
+}
+
+def _invalid_action(action):
+    """Build the error result for an unknown transport action"""
+    return {"error": f"Invalid transport action: {action}"}
+
 def cmd_transport_control(params):
     """Control transport (play, stop, record)"""
     try:
         # Get parameters
         action = params.get("action", 0) # 0=play, 1=stop, 2=record, 3=toggle
 
-        if action == 0: # Play
-            transport.start()
-            return {"success": True, "action": "play"}
-        elif action == 1: # Stop
-            transport.stop()
-            return {"success": True, "action": "stop"}
-        elif action == 2: # Record
-            transport.record()
-            return {"success": True, "action": "record"}
-        elif action == 3: # Toggle
-            if transport.isPlaying():
-                transport.stop()
-                return {"success": True, "action": "stop"}
-            else:
-                transport.start()
-                return {"success": True, "action": "play"}
-        else:
-            return {"error": f"Invalid transport action: {action}"}
+        handler = _TRANSPORT_ACTIONS.get(action)
+        if handler is None:
+            return _invalid_action(action)
+        return handler()
     except Exception as e:
         print(f"Error in transport_control: {str(e)}")
         return {"error": str(e)}
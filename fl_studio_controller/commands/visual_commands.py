@@ -2,12 +2,18 @@
 Visual commands and color animations for FL Studio MCP Controller
 """
 
+import array
 import channels
 import random
 import math
+import functools
+import re
 import time
 import ui
 
+# Maps a random byte to a color component in 30-255, so colors don't get too dark
+_RANDOM_COMPONENT_TABLE = bytes(30 + (x * 226 >> 8) for x in range(256))
+
 def randomize_channel_colors(selected_only=False):
     """Randomize the colors of all channels or just selected ones
     
@@ -18,27 +24,26 @@ def randomize_channel_colors(selected_only=False):
         dict: Result information
     """
     try:
-        count = 0
-        # Get the number of channels
-        total_channels = channels.channelCount()
+        # Colors may have been changed by hand since the last command
+        invalidate_color_cache()
         
-        for i in range(total_channels):
-            # Check if we should process this channel
-            if selected_only and not channels.isChannelSelected(i):
-                continue
-            
-            # Generate a random color in 0xBBGGRR format (FL Studio uses this format)
-            # Each component is 0-255
-            r = random.randint(30, 255)
-            g = random.randint(30, 255)
-            b = random.randint(30, 255)
-            
-            # Convert to FL Studio color format (0xBBGGRR)
-            color = (b << 16) | (g << 8) | r
-            
-            # Set the channel color
-            channels.setChannelColor(i, color)
-            count += 1
+        # Identify channels to color
+        channels_to_color = _get_target_channels(selected_only)
+        
+        # Draw three random bytes per channel in one call and scale them all into 30-255
+        count = len(channels_to_color)
+        if count:
+            data = random.getrandbits(24 * count).to_bytes(3 * count, "little")
+            data = data.translate(_RANDOM_COMPONENT_TABLE)
+        else:
+            data = b""
+        
+        # Each little-endian R, G, B triple is already a color in 0xBBGGRR format
+        from_bytes = int.from_bytes
+        colors = [from_bytes(data[k:k + 3], "little") for k in range(0, len(data), 3)]
+        
+        # Set the channel colors
+        apply_colors(channels_to_color, colors)
         
         return {"success": True, "count": count}
     except Exception as e:
@@ -79,6 +84,388 @@ def hsv_to_rgb(h, s, v):
     else:
         return v, p, q
 
+def hsv_to_packed(h, s, v):
+    """Convert HSV color straight to FL Studio's packed color format
+    
+    Args:
+        h (float): Hue (0-1)
+        s (float): Saturation (0-1)
+        v (float): Value (0-1)
+        
+    Returns:
+        int: Color in 0xBBGGRR format
+    """
+    r, g, b = hsv_to_rgb(h, s, v)
+    return (int(b * 255) << 16) | (int(g * 255) << 8) | int(r * 255)
+
+def hsv_to_packed_int(h, s, v):
+    """Convert integer HSV straight to FL Studio's packed color format
+    
+    Integer-only version of hsv_to_packed for building color tables.
+    
+    Args:
+        h (int): Hue (0-1535, 256 steps per sector)
+        s (int): Saturation (0-255)
+        v (int): Value (0-255)
+        
+    Returns:
+        int: Color in 0xBBGGRR format
+    """
+    sector = h >> 8
+    f = h & 0xFF
+    p = v * (255 - s) // 255
+    q = v * (65280 - s * f) // 65280
+    t = v * (65280 - s * (255 - f)) // 65280
+    r, g, b = ((v, t, p), (q, v, p), (p, v, t), (p, q, v), (t, p, v), (v, p, q))[sector]
+    return (b << 16) | (g << 8) | r
+
+# --- Color Lookup Tables ---
+
+@functools.lru_cache(maxsize=8)
+def channel_positions(total_channels):
+    """Get each channel position's fraction of the way along the channels
+    
+    Args:
+        total_channels (int): Number of channels
+        
+    Returns:
+        tuple: pos / total_channels for every position
+    """
+    return tuple(pos / total_channels for pos in range(total_channels))
+
+HUE_LUT_SIZE = 360
+PULSE_BRIGHTNESS_STEPS = 64
+ANIMATION_TABLE_CACHE_SIZE = 8 # per-animation tables kept for reuse
+
+def _build_hue_lut(s, v):
+    """Build a table of packed colors (0xBBGGRR) for evenly spaced hues
+    
+    Args:
+        s (float): Saturation (0-1)
+        v (float): Value (0-1)
+        
+    Returns:
+        list: HUE_LUT_SIZE packed colors, indexed by int(hue * HUE_LUT_SIZE)
+    """
+    s = int(s * 255 + 0.5)
+    v = int(v * 255 + 0.5)
+    return [hsv_to_packed_int(k * 1536 // HUE_LUT_SIZE, s, v) for k in range(HUE_LUT_SIZE)]
+
+# Rainbow and color cycle animations always use s=0.9, v=0.9
+_HUE_LUT = _build_hue_lut(0.9, 0.9)
+
+# Pulse table is only needed by pulse animations, so it is built on first use
+_pulse_lut = None
+
+def _get_pulse_lut():
+    """Get the flat hue x brightness table used by pulse animations
+    
+    Returns:
+        list: Packed colors, indexed by brightness_idx * HUE_LUT_SIZE + hue_idx
+    """
+    global _pulse_lut
+    if _pulse_lut is None:
+        lut = []
+        for step in range(PULSE_BRIGHTNESS_STEPS):
+            lut.extend(_build_hue_lut(0.9, step / (PULSE_BRIGHTNESS_STEPS - 1)))
+        _pulse_lut = lut
+    return _pulse_lut
+
+@functools.lru_cache(maxsize=ANIMATION_TABLE_CACHE_SIZE)
+def _rainbow_palette(total_channels, total_frames):
+    """Compute the per-channel colors of every rainbow shift frame
+    
+    Args:
+        total_channels (int): Number of channels being animated
+        total_frames (int): Total number of frames in the animation
+        
+    Returns:
+        array.array: Flat packed colors, frame by frame; frame f's row
+                     starts at f * total_channels
+    """
+    lut = _HUE_LUT
+    size = HUE_LUT_SIZE
+    # Channel offsets along the hue circle don't change between frames
+    offsets = channel_positions(total_channels)
+    palette = array.array('I')
+    for frame in range(total_frames):
+        progress = frame / total_frames
+        palette.extend([lut[int(((offset + progress) % 1.0) * size) % size] for offset in offsets])
+    return palette
+
+@functools.lru_cache(maxsize=ANIMATION_TABLE_CACHE_SIZE)
+def _cycle_palette(total_frames):
+    """Compute the shared color of every color cycle frame
+    
+    Args:
+        total_frames (int): Total number of frames in the animation
+        
+    Returns:
+        array.array: One packed color per frame
+    """
+    lut = _HUE_LUT
+    size = HUE_LUT_SIZE
+    return array.array('I', [lut[int((frame / total_frames) * size) % size] for frame in range(total_frames)])
+
+@functools.lru_cache(maxsize=ANIMATION_TABLE_CACHE_SIZE)
+def _pulse_rows(total_frames):
+    """Compute the pulse table row each frame reads from
+    
+    Args:
+        total_frames (int): Total number of frames in the animation
+        
+    Returns:
+        list: Offset into the pulse table of each frame's brightness level
+    """
+    rows = []
+    for frame in range(total_frames):
+        # Brightness pulses from 0.4 to 1.0 over the animation
+        brightness = 0.4 + 0.6 * (0.5 + 0.5 * math.sin(frame / total_frames * 2 * math.pi))
+        rows.append(int(brightness * (PULSE_BRIGHTNESS_STEPS - 1) + 0.5) * HUE_LUT_SIZE)
+    return rows
+
+@functools.lru_cache(maxsize=ANIMATION_TABLE_CACHE_SIZE)
+def _pulse_hues(total_channels):
+    """Compute each channel position's fixed hue as a column of the pulse table"""
+    return [int(offset * HUE_LUT_SIZE) % HUE_LUT_SIZE for offset in channel_positions(total_channels)]
+
+def _build_palette(animation_type, total_channels, total_frames):
+    """Precompute the colors of every frame of a periodic animation
+    
+    Args:
+        animation_type (int): 0=rainbow shift, 1=pulse, 2=color cycle
+        total_channels (int): Number of channels being animated
+        total_frames (int): Total number of frames in the animation
+        
+    Returns:
+        array.array: Rainbow shift: flat per-channel colors, one row per frame.
+                     Color cycle: one color per frame. Pulse: None (rendered from the pulse table)
+    """
+    if animation_type == 0:  # Rainbow shift
+        return _rainbow_palette(total_channels, total_frames)
+    elif animation_type == 1:  # Pulse
+        return None
+    else:  # Color cycle
+        return _cycle_palette(total_frames)
+
+def _animation_tables(animation_type, total_channels, total_frames):
+    """Get the precomputed color tables an animation renders from
+    
+    Tables are cached by their dimensions and shared between animations,
+    so the render kernels only ever read them.
+    """
+    return {
+        "pulse_lut": _get_pulse_lut() if animation_type == 1 else None,
+        "pulse_rows": _pulse_rows(total_frames) if animation_type == 1 else None,
+        "pulse_hues": _pulse_hues(total_channels) if animation_type == 1 else None,
+        "palette": _build_palette(animation_type, total_channels, total_frames),
+        "render": _RENDER_KERNELS.get(animation_type, _render_cycle)
+    }
+
+# --- Animation State ---
+
+class AnimState:
+    """State of a step or smooth animation
+    
+    Slotted so the renderers read fields as attributes instead of
+    going through dict lookups on every frame.
+    """
+    __slots__ = (
+        "is_running", "start_time", "frame_delay", "current_frame", "total_frames",
+        "end_frame", "animation_type", "selected_only", "channels", "palette", "pulse_lut",
+        "pulse_rows", "pulse_hues", "last_colors", "last_pulse_row", "render",
+        "clock_start", "next_frame_time"
+    )
+    
+    def __init__(self, **fields):
+        unknown = fields.keys() - set(self.__slots__)
+        if unknown:
+            raise TypeError(f"Unknown AnimState fields: {', '.join(sorted(unknown))}")
+        for name in self.__slots__:
+            setattr(self, name, fields.get(name))
+    
+    def reset_colors(self):
+        """Forget the colors written so far so the next frame writes every channel"""
+        self.last_colors = [None] * len(self.channels)
+        self.last_pulse_row = None
+    
+    # Precomputed tables and render bookkeeping, left out of to_dict
+    _INTERNAL_FIELDS = frozenset((
+        "palette", "pulse_lut", "pulse_rows", "pulse_hues", "last_colors", "last_pulse_row", "render"
+    ))
+    
+    def to_dict(self):
+        """Get the state as a plain dictionary (e.g. for JSON feedback)
+        
+        Precomputed tables, the render kernel and fields this kind of animation
+        doesn't use (None) are left out; the channel indices become a list.
+        """
+        state = {}
+        for name in self.__slots__:
+            if name in self._INTERNAL_FIELDS:
+                continue
+            value = getattr(self, name)
+            if value is None:
+                continue
+            if isinstance(value, array.array):
+                value = value.tolist()
+            state[name] = value
+        return state
+
+# --- Channel Selection Cache ---
+
+# Channel count and selection are reused for a short time so bursts of
+# effects and animation setups don't query every channel again
+CHANNEL_CACHE_TTL = 0.05 # seconds
+
+def _ttl_cache(ttl):
+    """Decorator that reuses a no-argument function's result for ttl seconds"""
+    def decorator(func):
+        cache = {"value": None, "t": None}
+        
+        @functools.wraps(func)
+        def wrapper():
+            now = time.monotonic()
+            if cache["t"] is None or now - cache["t"] >= ttl:
+                cache["value"] = func()
+                cache["t"] = now
+            return cache["value"]
+        
+        def cache_clear():
+            cache["t"] = None
+        
+        wrapper.cache_clear = cache_clear
+        return wrapper
+    return decorator
+
+@_ttl_cache(CHANNEL_CACHE_TTL)
+def get_channel_count():
+    """Get the channel count
+    
+    Shared for CHANNEL_CACHE_TTL seconds, like the selection mask.
+    """
+    return channels.channelCount()
+
+@_ttl_cache(CHANNEL_CACHE_TTL)
+def get_selection_mask():
+    """Get the selection state of every channel as bytes of 0/1
+    
+    The result is shared for CHANNEL_CACHE_TTL seconds, so callers running
+    every frame (like the device script's animation) reuse one scan.
+    """
+    total_channels = get_channel_count()
+    # With nothing selected there's no need to ask about each channel
+    if channels.selectedChannel(canBeNone=True) < 0:
+        return bytes(total_channels)
+    return bytes(map(channels.isChannelSelected, range(total_channels)))
+
+def _get_target_channels(selected_only):
+    """Get the indices of the channels an effect should color
+    
+    Args:
+        selected_only (bool): Only include selected channels
+        
+    Returns:
+        array.array: Channel indices (compact unsigned ints)
+    """
+    if selected_only:
+        return array.array('I', [i for i, selected in enumerate(get_selection_mask()) if selected])
+    return array.array('I', range(get_channel_count()))
+
+# --- Channel Color Helpers ---
+
+# Colors last written to each channel, so a running animation doesn't set
+# colors that haven't changed since its previous frame. FL Studio doesn't tell
+# the script about colors changed by hand, so the cache only holds within one
+# command or animation run: every effect and animation start resets it, as do
+# other color writes (channel_commands), a channel count change, a project
+# load and a channel rack group change.
+_written_colors = {}
+_written_colors_key = None
+
+def invalidate_color_cache():
+    """Forget the colors written so far so the next effect writes every channel"""
+    global _written_colors_key
+    _written_colors.clear()
+    _written_colors_key = None
+
+def apply_colors(channels_to_color, colors):
+    """Write precomputed colors to channels, skipping those this module already set
+    
+    Args:
+        channels_to_color (array.array): Channel indices to update
+        colors (list): Packed colors (0xBBGGRR), one per channel in the same order
+    """
+    # Written colors are tracked per channel count, so drop them if it changed
+    global _written_colors_key
+    total_channels = get_channel_count()
+    if total_channels != _written_colors_key:
+        _written_colors.clear()
+        _written_colors_key = total_channels
+    
+    written = _written_colors
+    set_color = channels.setChannelColor
+    for channel_idx, color in zip(channels_to_color, colors):
+        if written.get(channel_idx) != color:
+            set_color(channel_idx, color)
+            written[channel_idx] = color
+
+def _push_frame(animation_state, colors, base=0):
+    """Write an animation frame, skipping channels whose color is unchanged
+    
+    Args:
+        animation_state (AnimState): Animation state (its last_colors is updated)
+        colors (list): Packed colors, one per animated channel in order
+        base (int): Index in colors of the first channel's color
+    """
+    last_colors = animation_state.last_colors
+    written = _written_colors
+    set_color = channels.setChannelColor
+    for pos, channel_idx in enumerate(animation_state.channels):
+        color = colors[base + pos]
+        if last_colors[pos] != color:
+            set_color(channel_idx, color)
+            last_colors[pos] = color
+            # Keep apply_colors' record in step with what the channel now shows
+            written[channel_idx] = color
+
+# --- Animation Frame Kernels ---
+# One kernel per animation type, picked at setup so rendering a frame
+# doesn't have to branch on the type. Each writes the state's current frame.
+# Kernels don't catch exceptions themselves; next_animation_frame and
+# render_animation_frame handle errors around the kernel call.
+
+def _render_rainbow(animation_state):
+    """Shifting rainbow where colors move across channels"""
+    # Read from the palette row precomputed for this frame
+    base = animation_state.current_frame * len(animation_state.channels)
+    _push_frame(animation_state, animation_state.palette, base)
+
+def _render_pulse(animation_state):
+    """All channels pulse together, each with a fixed hue"""
+    # Table row for this frame's brightness, precomputed at setup
+    row = animation_state.pulse_rows[animation_state.current_frame]
+    
+    # Neighbouring frames often land on the same brightness step,
+    # in which case every color would be identical to the last frame
+    if row == animation_state.last_pulse_row:
+        return
+    animation_state.last_pulse_row = row
+    
+    pulse_lut = animation_state.pulse_lut
+    colors = [pulse_lut[row + hue] for hue in animation_state.pulse_hues]
+    _push_frame(animation_state, colors)
+
+def _render_cycle(animation_state):
+    """All channels shift through the same color spectrum together"""
+    color = animation_state.palette[animation_state.current_frame]
+    
+    # Every channel shares one color, so a repeat means nothing to write
+    if animation_state.last_colors[0] != color:
+        _push_frame(animation_state, [color] * len(animation_state.channels))
+
+_RENDER_KERNELS = {0: _render_rainbow, 1: _render_pulse}
+
 def cmd_randomize_colors(params):
     """Randomize channel colors in the channel rack"""
     try:
@@ -95,37 +482,41 @@ def cmd_randomize_colors(params):
 
 # --- Step Animation Functions ---
 
-def animation_setup(animation_type=0, selected_only=False, total_frames=30):
+def animation_setup(animation_type=0, selected_only=False, total_frames=30, store_state=None):
     """Set up a step-by-step animation that can be manually advanced
     
     Args:
         animation_type (int): 0=rainbow shift, 1=pulse, 2=color cycle
         selected_only (bool): Only animate selected channels
         total_frames (int): Total number of frames in the animation
+        store_state (callable): Called with the AnimState so the caller can keep it
+                                for next_animation_frame; the result only holds a
+                                plain dict snapshot of it
     """
     try:
+        # A new run starts from the channels' current colors
+        invalidate_color_cache()
+        
         # Identify channels to animate
-        channels_to_color = []
-        total_channels = channels.channelCount()
+        channels_to_color = _get_target_channels(selected_only)
         
-        for i in range(total_channels):
-            if selected_only and not channels.isChannelSelected(i):
-                continue
-            channels_to_color.append(i)
-            
         if not channels_to_color:
             return {"success": False, "message": "No channels to color"}
         
         # Create animation state
-        animation_state = {
-            "current_frame": 0,
-            "total_frames": total_frames,
-            "animation_type": animation_type,
-            "selected_only": selected_only,
-            "channels": channels_to_color
-        }
-        
-        return {"success": True, "type": animation_type, "channels": len(channels_to_color), "state": animation_state}
+        animation_state = AnimState(
+            current_frame=0,
+            total_frames=total_frames,
+            animation_type=animation_type,
+            selected_only=selected_only,
+            channels=channels_to_color,
+            **_animation_tables(animation_type, len(channels_to_color), total_frames)
+        )
+        animation_state.reset_colors()
+        if store_state:
+            store_state(animation_state)
+        
+        return {"success": True, "type": animation_type, "channels": len(channels_to_color), "state": animation_state.to_dict()}
     except Exception as e:
         print(f"Error in animation setup: {str(e)}")
         return {"error": str(e)}
@@ -134,65 +525,29 @@ def next_animation_frame(animation_state):
     """Render the next frame of the step animation
     
     Args:
-        animation_state (dict): Animation state dictionary
+        animation_state (AnimState): Animation state
     
     Returns:
         dict: Result information including current frame
     """
     try:
         # Check if animation is set up
-        if not animation_state["channels"]:
+        if not animation_state.channels:
             return {"success": False, "message": "No animation setup."}
         
         # Get animation state
-        current_frame = animation_state["current_frame"]
-        total_frames = animation_state["total_frames"]
-        animation_type = animation_state["animation_type"]
-        channels_to_color = animation_state["channels"]
-        total_channels = len(channels_to_color)
+        current_frame = animation_state.current_frame
+        total_frames = animation_state.total_frames
+        animation_type = animation_state.animation_type
         
         # Calculate progress (0.0 to 1.0)
         progress = current_frame / total_frames
         
-        # Apply the appropriate animation type
-        if animation_type == 0:  # Rainbow shift
-            # Shifting rainbow where colors move across channels
-            for pos, channel_idx in enumerate(channels_to_color):
-                # Offset each channel's color by the progress amount to create movement
-                hue = ((pos / total_channels) + progress) % 1.0
-                
-                r, g, b = hsv_to_rgb(hue, 0.9, 0.9)
-                r, g, b = int(r * 255), int(g * 255), int(b * 255)
-                color = (b << 16) | (g << 8) | r
-                channels.setChannelColor(channel_idx, color)
-        
-        elif animation_type == 1:  # Pulse
-            # All channels pulse together
-            # Calculate brightness that pulses from 0.4 to 1.0
-            brightness = 0.4 + 0.6 * (0.5 + 0.5 * math.sin(progress * 2 * math.pi))
-            
-            for pos, channel_idx in enumerate(channels_to_color):
-                # Each channel has a fixed hue but brightness changes
-                hue = pos / total_channels
-                
-                r, g, b = hsv_to_rgb(hue, 0.9, brightness)
-                r, g, b = int(r * 255), int(g * 255), int(b * 255)
-                color = (b << 16) | (g << 8) | r
-                channels.setChannelColor(channel_idx, color)
-        
-        else:  # Color cycle - all channels change color together
-            # All channels shift through the same color spectrum together
-            hue = progress
-            
-            r, g, b = hsv_to_rgb(hue, 0.9, 0.9)
-            r, g, b = int(r * 255), int(g * 255), int(b * 255)
-            color = (b << 16) | (g << 8) | r
-            
-            for channel_idx in channels_to_color:
-                channels.setChannelColor(channel_idx, color)
+        # Render with the kernel chosen for this animation type at setup
+        animation_state.render(animation_state)
         
         # Update the frame counter
-        animation_state["current_frame"] = (current_frame + 1) % total_frames
+        animation_state.current_frame = (current_frame + 1) % total_frames
         
         return {
             "success": True, 
@@ -208,7 +563,7 @@ def next_animation_frame(animation_state):
 
 # --- Smooth Animation Functions ---
 
-def run_smooth_animation(animation_type=0, selected_only=False, duration_seconds=5, frames_per_second=10):
+def run_smooth_animation(animation_type=0, selected_only=False, duration_seconds=5, frames_per_second=10, store_state=None):
     """Start a smooth animation that runs for the specified duration
     
     Args:
@@ -216,17 +571,17 @@ def run_smooth_animation(animation_type=0, selected_only=False, duration_seconds
         selected_only (bool): Only animate selected channels
         duration_seconds (float): How long the animation should run in seconds
         frames_per_second (int): How many frames to render per second
+        store_state (callable): Called with the AnimState so the caller can drive it
+                                with tick_animation; the result only holds a plain
+                                dict snapshot of it
     """
     try:
+        # A new run starts from the channels' current colors
+        invalidate_color_cache()
+        
         # Identify channels to animate
-        channels_to_color = []
-        total_channels = channels.channelCount()
+        channels_to_color = _get_target_channels(selected_only)
         
-        for i in range(total_channels):
-            if selected_only and not channels.isChannelSelected(i):
-                continue
-            channels_to_color.append(i)
-            
         if not channels_to_color:
             return {"success": False, "message": "No channels to color"}
         
@@ -234,29 +589,36 @@ def run_smooth_animation(animation_type=0, selected_only=False, duration_seconds
         total_frames = int(duration_seconds * frames_per_second)
         frame_delay = 1.0 / frames_per_second
         
-        # Set up animation state
-        animation_state = {
-            "is_running": True,
-            "start_time": time.time(),
-            "frame_delay": frame_delay,
-            "current_frame": 0,
-            "total_frames": total_frames,
-            "end_frame": total_frames,
-            "animation_type": animation_type,
-            "selected_only": selected_only,
-            "channels": channels_to_color
-        }
-        
-        # Start the animation loop
-        # Note: In a real implementation, this would need to be triggered by a separate UI timer
-        # or by FL Studio's OnIdle mechanism
+        # Set up animation state, with the first frame due right away
+        # Frames are scheduled on the monotonic clock; start_time (wall clock)
+        # is only used to report how long the animation ran
+        clock_start = time.monotonic()
+        animation_state = AnimState(
+            is_running=True,
+            start_time=time.time(),
+            clock_start=clock_start,
+            next_frame_time=clock_start,
+            frame_delay=frame_delay,
+            current_frame=0,
+            total_frames=total_frames,
+            end_frame=total_frames,
+            animation_type=animation_type,
+            selected_only=selected_only,
+            channels=channels_to_color,
+            **_animation_tables(animation_type, len(channels_to_color), total_frames)
+        )
+        animation_state.reset_colors()
+        if store_state:
+            store_state(animation_state)
+        
+        # Frames are rendered from the script's OnIdle hook via tick_animation
         
         return {
             "success": True, 
             "type": animation_type,
             "frames": total_frames,
             "duration": duration_seconds,
-            "state": animation_state
+            "state": animation_state.to_dict()
         }
     except Exception as e:
         print(f"Error starting smooth animation: {str(e)}")
@@ -266,86 +628,78 @@ def render_animation_frame(animation_state):
     """Render a frame of animation based on the animation state
     
     Args:
-        animation_state (dict): Animation state dictionary
+        animation_state (AnimState): Animation state
         
     Returns:
         bool: True if animation should continue, False if finished
     """
     # Check if animation should still be running
-    if not animation_state["is_running"] or animation_state["current_frame"] >= animation_state["end_frame"]:
+    if not animation_state.is_running or animation_state.current_frame >= animation_state.end_frame:
         return False
     
     try:
-        # Get animation state
-        current_frame = animation_state["current_frame"]
-        total_frames = animation_state["total_frames"]
-        animation_type = animation_state["animation_type"]
-        channels_to_color = animation_state["channels"]
-        total_channels = len(channels_to_color)
-        
-        # Calculate progress (0.0 to 1.0)
-        progress = current_frame / total_frames
-        
-        # Apply the appropriate animation type
-        if animation_type == 0:  # Rainbow shift
-            # Shifting rainbow where colors move across channels
-            for pos, channel_idx in enumerate(channels_to_color):
-                # Offset each channel's color by the progress amount to create movement
-                hue = ((pos / total_channels) + progress) % 1.0
-                
-                r, g, b = hsv_to_rgb(hue, 0.9, 0.9)
-                r, g, b = int(r * 255), int(g * 255), int(b * 255)
-                color = (b << 16) | (g << 8) | r
-                channels.setChannelColor(channel_idx, color)
-        
-        elif animation_type == 1:  # Pulse
-            # All channels pulse together
-            # Calculate brightness that pulses from 0.4 to 1.0
-            brightness = 0.4 + 0.6 * (0.5 + 0.5 * math.sin(progress * 2 * math.pi))
-            
-            for pos, channel_idx in enumerate(channels_to_color):
-                # Each channel has a fixed hue but brightness changes
-                hue = pos / total_channels
-                
-                r, g, b = hsv_to_rgb(hue, 0.9, brightness)
-                r, g, b = int(r * 255), int(g * 255), int(b * 255)
-                color = (b << 16) | (g << 8) | r
-                channels.setChannelColor(channel_idx, color)
-        
-        else:  # Color cycle - all channels change color together
-            # All channels shift through the same color spectrum together
-            hue = progress % 1.0
-            
-            r, g, b = hsv_to_rgb(hue, 0.9, 0.9)
-            r, g, b = int(r * 255), int(g * 255), int(b * 255)
-            color = (b << 16) | (g << 8) | r
-            
-            for channel_idx in channels_to_color:
-                channels.setChannelColor(channel_idx, color)
+        # Render with the kernel chosen for this animation type at setup
+        animation_state.render(animation_state)
         
         # Update the frame counter
-        animation_state["current_frame"] += 1
+        total_frames = animation_state.total_frames
+        animation_state.current_frame += 1
         
         # Show progress in hint bar
-        if animation_state["current_frame"] % 10 == 0:
-            ui.setHintMsg(f"Animation frame {animation_state['current_frame']}/{total_frames}")
+        if animation_state.current_frame % 10 == 0:
+            ui.setHintMsg(f"Animation frame {animation_state.current_frame}/{total_frames}")
         
         return True
         
     except Exception as e:
         print(f"Error in animation frame: {str(e)}")
-        animation_state["is_running"] = False
+        animation_state.is_running = False
+        return False
+
+def tick_animation(animation_state):
+    """Render the next frame of a smooth animation once its deadline has passed
+    
+    Polled from the script's OnIdle hook, so no frame has to schedule the next one.
+    Frame k is due at clock_start + k * frame_delay on the monotonic clock, so
+    neither render time nor wall clock changes make the frame rate drift.
+    Frames that are already late when the animation gets to them are dropped
+    so it still finishes on time.
+    
+    Args:
+        animation_state (AnimState): Animation state
+        
+    Returns:
+        bool: True while the animation is still running
+    """
+    if not animation_state.is_running:
+        return False
+    
+    now = time.monotonic()
+    if now < animation_state.next_frame_time:
+        return True
+    
+    # Skip ahead to the frame that is due now
+    clock_start = animation_state.clock_start
+    frame_delay = animation_state.frame_delay
+    due_frame = int((now - clock_start) / frame_delay)
+    if due_frame > animation_state.current_frame:
+        animation_state.current_frame = min(due_frame, animation_state.end_frame)
+    animation_state.next_frame_time = clock_start + (animation_state.current_frame + 1) * frame_delay
+    
+    if not render_animation_frame(animation_state):
+        animation_state.is_running = False
         return False
+    return True
 
 def stop_animation(animation_state):
     """Stop any running animation
     
     Args:
-        animation_state (dict): Animation state dictionary
+        animation_state (AnimState): Animation state
     """
-    if animation_state["is_running"]:
-        animation_state["is_running"] = False
-        duration = time.time() - animation_state["start_time"]
+    if animation_state.is_running:
+        animation_state.is_running = False
+        duration = time.time() - animation_state.start_time
         
         return {"success": True, "duration": duration}
     return {"success": False, "message": "No animation was running"}
@@ -359,29 +713,22 @@ def rainbow_pattern(selected_only=False):
         selected_only (bool): Only colorize selected channels
     """
     try:
+        # Colors may have been changed by hand since the last command
+        invalidate_color_cache()
+        
         # Identify channels to color
-        channels_to_color = []
-        total_channels = channels.channelCount()
+        channels_to_color = _get_target_channels(selected_only)
         
-        for i in range(total_channels):
-            if selected_only and not channels.isChannelSelected(i):
-                continue
-            channels_to_color.append(i)
-            
         if not channels_to_color:
             return {"success": False, "message": "No channels to color"}
         
         total_to_color = len(channels_to_color)
         
-        # Apply rainbow colors
-        for pos, channel_idx in enumerate(channels_to_color):
-            # Create a rainbow pattern based on position
-            hue = pos / total_to_color
-            
-            r, g, b = hsv_to_rgb(hue, 0.9, 0.9)
-            r, g, b = int(r * 255), int(g * 255), int(b * 255)
-            color = (b << 16) | (g << 8) | r
-            channels.setChannelColor(channel_idx, color)
+        # Compute the rainbow for every position first, then apply it in one pass
+        # Colors come from the s=v=0.9 hue table, one hue step per position
+        lut = _HUE_LUT
+        colors = [lut[pos * HUE_LUT_SIZE // total_to_color] for pos in range(total_to_color)]
+        apply_colors(channels_to_color, colors)
         
         return {"success": True, "count": total_to_color}
     except Exception as e:
@@ -396,43 +743,35 @@ def color_groups(selected_only=False, groups=4):
         groups (int): Number of color groups
     """
     try:
+        # Colors may have been changed by hand since the last command
+        invalidate_color_cache()
+        
         # Identify channels to color
-        channels_to_color = []
-        total_channels = channels.channelCount()
+        channels_to_color = _get_target_channels(selected_only)
         
-        for i in range(total_channels):
-            if selected_only and not channels.isChannelSelected(i):
-                continue
-            channels_to_color.append(i)
-            
         if not channels_to_color:
             return {"success": False, "message": "No channels to color"}
         
         total_to_color = len(channels_to_color)
         
-        # Generate a set of distinct colors
-        group_colors = []
-        for g in range(groups):
-            # Use evenly spaced hues for maximum color difference
-            hue = g / groups
-            # Generate saturated, bright colors
-            r, g, b = hsv_to_rgb(hue, 0.9, 0.9)
-            r, g, b = int(r * 255), int(g * 255), int(b * 255)
-            color = (b << 16) | (g << 8) | r
-            group_colors.append(color)
-        
-        # Apply colors in groups
-        for pos, channel_idx in enumerate(channels_to_color):
-            # Determine which group this channel belongs to
-            group = pos % groups
-            # Apply the color for this group
-            channels.setChannelColor(channel_idx, group_colors[group])
+        # Generate a set of distinct colors, using evenly spaced hues
+        # for maximum color difference
+        group_colors = [_HUE_LUT[g * HUE_LUT_SIZE // groups] for g in range(groups)]
+        
+        # Assign each position the color of the group it belongs to
+        colors = [group_colors[pos % groups] for pos in range(total_to_color)]
+        apply_colors(channels_to_color, colors)
         
         return {"success": True, "count": total_to_color, "groups": groups}
     except Exception as e:
         print(f"Error applying color groups: {str(e)}")
         return {"error": str(e)}
 
+@functools.lru_cache(maxsize=16)
+def _brightness_table(limit):
+    """Get a byte translation table scaling 0-255 down to 0-limit"""
+    return bytes(x * limit // 255 for x in range(256))
+
 def random_colors(selected_only=False, brightness=0.9):
     """Apply random colors to channels
     
@@ -441,43 +780,84 @@ def random_colors(selected_only=False, brightness=0.9):
         brightness (float): Brightness of colors (0.0-1.0)
     """
     try:
+        # Colors may have been changed by hand since the last command
+        invalidate_color_cache()
+        
         # Identify channels to color
-        channels_to_color = []
-        total_channels = channels.channelCount()
+        channels_to_color = _get_target_channels(selected_only)
         
-        for i in range(total_channels):
-            if selected_only and not channels.isChannelSelected(i):
-                continue
-            channels_to_color.append(i)
-            
         if not channels_to_color:
             return {"success": False, "message": "No channels to color"}
         
         total_to_color = len(channels_to_color)
         
-        # Apply random colors
-        for channel_idx in channels_to_color:
-            # Generate random color with specified brightness
-            r = int(random.uniform(0, brightness) * 255)
-            g = int(random.uniform(0, brightness) * 255)
-            b = int(random.uniform(0, brightness) * 255)
+        # Components are drawn as 0-255 and scaled down to the brightness limit,
+        # all channels in one draw with the scaling done by a byte table
+        limit = min(255, max(0, int(brightness * 255)))
+        data = random.getrandbits(24 * total_to_color).to_bytes(3 * total_to_color, "little")
+        data = data.translate(_brightness_table(limit))
+        from_bytes = int.from_bytes
+        
+        # Generate all random colors first
+        colors = []
+        for k in range(0, 3 * total_to_color, 3):
+            rgb = data[k:k + 3]
             
             # Make sure colors are reasonably bright
-            max_component = max(r, g, b)
+            max_component = max(rgb)
             if max_component < 100:
+                # Scaling the brightest component up to 100 keeps all of them in range
+                r, g, b = rgb
                 scale = 100 / max_component if max_component > 0 else 1
-                r = min(255, int(r * scale))
-                g = min(255, int(g * scale))
-                b = min(255, int(b * scale))
-            
-            color = (b << 16) | (g << 8) | r
-            channels.setChannelColor(channel_idx, color)
+                colors.append((int(b * scale) << 16) | (int(g * scale) << 8) | int(r * scale))
+            else:
+                # Little-endian R, G, B bytes are already 0xBBGGRR
+                colors.append(from_bytes(rgb, "little"))
+        
+        apply_colors(channels_to_color, colors)
         
         return {"success": True, "count": total_to_color}
     except Exception as e:
         print(f"Error applying random colors: {str(e)}")
         return {"error": str(e)}
 
+# Colors for different channel types, guessed from the channel name.
+# Listed in priority order: the first type found in a name wins.
+_TYPE_COLORS = (
+    ("synth", 0x2090FF),     # Blue for synths
+    ("bass", 0x3050FF),      # Purple for bass
+    ("drum", 0xFF5050),      # Red for drums
+    ("kick", 0xFF5050),      # Red for kick
+    ("snare", 0xFF9090),     # Light red for snare
+    ("hat", 0xFFB060),       # Orange for hats
+    ("perc", 0xFFA030),      # Orange for percussion
+    ("vocal", 0x60D060),     # Green for vocals
+    ("vox", 0x60D060),       # Green for vocals
+    ("guitar", 0xFFD030),    # Yellow for guitar
+    ("piano", 0x60FFFF),     # Cyan for piano
+    ("key", 0x60FFFF),       # Cyan for keyboards
+    ("pad", 0xB090FF),       # Purple for pads
+    ("lead", 0xFF60A0),      # Pink for leads
+    ("fx", 0xAFAFAF)         # Gray for FX
+)
+_DEFAULT_TYPE_COLOR = 0xFFFFFF    # White default
+
+# One alternative per type, tried in priority order from the start of the
+# name, so a single match call finds the same type as checking each in turn.
+# The group that matched (lastindex) points back into _TYPE_COLORS.
+_TYPE_RE = re.compile("|".join(f".*?({re.escape(type_name)})" for type_name, _ in _TYPE_COLORS), re.DOTALL)
+
+# Lowercased channel names, reused until the channel count changes or
+# the device script reports renamed channels
+_name_cache = {}
+_name_cache_key = None
+
+def invalidate_name_cache():
+    """Forget the cached channel names so they are read again from FL Studio"""
+    global _name_cache_key
+    _name_cache.clear()
+    _name_cache_key = None
+
 def color_by_type(selected_only=False):
     """Color channels based on their type (instruments, samplers, effects)
     
@@ -485,63 +865,114 @@ def color_by_type(selected_only=False):
         selected_only (bool): Only colorize selected channels
     """
     try:
+        # Colors may have been changed by hand since the last command
+        invalidate_color_cache()
+        
         # Identify channels to color
-        channels_to_color = []
-        total_channels = channels.channelCount()
+        channels_to_color = _get_target_channels(selected_only)
         
-        for i in range(total_channels):
-            if selected_only and not channels.isChannelSelected(i):
-                continue
-            channels_to_color.append(i)
-            
         if not channels_to_color:
             return {"success": False, "message": "No channels to color"}
         
         total_to_color = len(channels_to_color)
         
-        # Define colors for different channel types
-        # We'll use names from channel.getChannelName to guess the type
-        colors = {
-            "synth": 0x2090FF,     # Blue for synths
-            "bass": 0x3050FF,      # Purple for bass
-            "drum": 0xFF5050,      # Red for drums
-            "kick": 0xFF5050,      # Red for kick
-            "snare": 0xFF9090,     # Light red for snare
-            "hat": 0xFFB060,       # Orange for hats
-            "perc": 0xFFA030,      # Orange for percussion
-            "vocal": 0x60D060,     # Green for vocals
-            "vox": 0x60D060,       # Green for vocals
-            "guitar": 0xFFD030,    # Yellow for guitar
-            "piano": 0x60FFFF,     # Cyan for piano
-            "key": 0x60FFFF,       # Cyan for keyboards
-            "pad": 0xB090FF,       # Purple for pads
-            "lead": 0xFF60A0,      # Pink for leads
-            "fx": 0xAFAFAF,        # Gray for FX
-            "default": 0xFFFFFF    # White default
-        }
+        # Names are cached per channel count, so drop them if it changed
+        global _name_cache_key
+        total_channels = get_channel_count()
+        if total_channels != _name_cache_key:
+            _name_cache.clear()
+            _name_cache_key = total_channels
+        
+        # Bind hot-loop callables to locals
+        get_name = channels.getChannelName
+        match_type = _TYPE_RE.match
+        name_cache = _name_cache
         
-        # Apply colors based on channel names
+        # Pick colors based on channel names
+        colors = []
         for channel_idx in channels_to_color:
-            # Get the channel name and convert to lowercase
-            name = channels.getChannelName(channel_idx).lower()
+            # Get the lowercased channel name, asking FL Studio only once
+            name = name_cache.get(channel_idx)
+            if name is None:
+                name = get_name(channel_idx).lower()
+                name_cache[channel_idx] = name
             
-            # Try to find a matching type
-            found_type = False
-            for type_name, color in colors.items():
-                if type_name in name:
-                    channels.setChannelColor(channel_idx, color)
-                    found_type = True
-                    break
-            
-            # Use default color if no match found
-            if not found_type:
-                channels.setChannelColor(channel_idx, colors["default"])
+            # Find the highest priority type in the name, or use the default color
+            m = match_type(name)
+            colors.append(_TYPE_COLORS[m.lastindex - 1][1] if m else _DEFAULT_TYPE_COLOR)
+        apply_colors(channels_to_color, colors)
         
         return {"success": True, "count": total_to_color}
     except Exception as e:
         print(f"Error in color by type: {str(e)}")
         return {"error": str(e)}
 
+def _gradient_colors(gradient_colors, count):
+    """Interpolate a list of RGB stops into packed colors
+    
+    Args:
+        gradient_colors (list): RGB tuples (0-255) to interpolate between
+        count (int): Number of colors to produce
+        
+    Returns:
+        list: Packed colors (0xBBGGRR) running from the first stop to the last
+    """
+    segment_count = len(gradient_colors) - 1
+    span = max(1, count - 1)
+    colors = []
+    for i in range(count):
+        # Calculate position in gradient (0.0 to 1.0)
+        pos = i / span
+        
+        # Interpolate between gradient colors
+        segment_pos = pos * segment_count
+        segment_index = min(int(segment_pos), segment_count - 1)
+        segment_offset = segment_pos - segment_index
+        
+        # Get the two colors to interpolate between
+        color1 = gradient_colors[segment_index]
+        color2 = gradient_colors[segment_index + 1]
+        
+        # Linear interpolation between colors, packed straight into
+        # FL Studio color format (0xBBGGRR)
+        colors.append(
+            (int(color1[2] + segment_offset * (color2[2] - color1[2])) << 16)
+            | (int(color1[1] + segment_offset * (color2[1] - color1[1])) << 8)
+            | int(color1[0] + segment_offset * (color2[0] - color1[0]))
+        )
+    return colors
+
+# Gradient presets - each is a list of colors to interpolate between
+_GRADIENT_PRESETS = [
+    # 0: Sunset - orange to purple
+    [(255, 100, 0), (255, 0, 100), (150, 0, 255)],
+    
+    # 1: Ocean - aqua to deep blue
+    [(0, 255, 255), (0, 100, 255), (0, 0, 150)],
+    
+    # 2: Forest - yellow-green to deep green
+    [(180, 255, 0), (30, 200, 0), (0, 100, 0)],
+    
+    # 3: Fire - yellow to red
+    [(255, 255, 0), (255, 150, 0), (255, 0, 0)],
+    
+    # 4: Neon - bright colors
+    [(255, 0, 255), (0, 255, 255), (255, 255, 0)]
+]
+_GRADIENT_NAMES = ["Sunset", "Ocean", "Forest", "Fire", "Neon"]
+
+# Each preset is interpolated once into a table of this many colors
+GRADIENT_LUT_SIZE = 256
+_GRADIENT_LUTS = {}
+
+def _get_gradient_lut(preset_index):
+    """Get the lookup table for a gradient preset, building it on first use"""
+    lut = _GRADIENT_LUTS.get(preset_index)
+    if lut is None:
+        lut = _gradient_colors(_GRADIENT_PRESETS[preset_index], GRADIENT_LUT_SIZE)
+        _GRADIENT_LUTS[preset_index] = lut
+    return lut
+
 def gradient_preset(preset=0, selected_only=False):
     """Apply a preset gradient to channels
     
@@ -550,68 +981,28 @@ def gradient_preset(preset=0, selected_only=False):
         selected_only (bool): Only colorize selected channels
     """
     try:
+        # Colors may have been changed by hand since the last command
+        invalidate_color_cache()
+        
         # Identify channels to color
-        channels_to_color = []
-        total_channels = channels.channelCount()
+        channels_to_color = _get_target_channels(selected_only)
         
-        for i in range(total_channels):
-            if selected_only and not channels.isChannelSelected(i):
-                continue
-            channels_to_color.append(i)
-            
         if not channels_to_color:
             return {"success": False, "message": "No channels to color"}
         
         total_to_color = len(channels_to_color)
         
-        # Define gradient presets - each is a list of colors to interpolate between
-        presets = [
-            # 0: Sunset - orange to purple
-            [(255, 100, 0), (255, 0, 100), (150, 0, 255)],
-            
-            # 1: Ocean - aqua to deep blue
-            [(0, 255, 255), (0, 100, 255), (0, 0, 150)],
-            
-            # 2: Forest - yellow-green to deep green
-            [(180, 255, 0), (30, 200, 0), (0, 100, 0)],
-            
-            # 3: Fire - yellow to red
-            [(255, 255, 0), (255, 150, 0), (255, 0, 0)],
-            
-            # 4: Neon - bright colors
-            [(255, 0, 255), (0, 255, 255), (255, 255, 0)]
-        ]
-        
         # Get the selected preset
-        preset_index = preset % len(presets)
-        gradient_colors = presets[preset_index]
+        preset_index = preset % len(_GRADIENT_PRESETS)
         
-        # Apply gradient colors
-        for i, channel_idx in enumerate(channels_to_color):
-            # Calculate position in gradient (0.0 to 1.0)
-            pos = i / max(1, total_to_color - 1)
-            
-            # Interpolate between gradient colors
-            segment_count = len(gradient_colors) - 1
-            segment_pos = pos * segment_count
-            segment_index = min(int(segment_pos), segment_count - 1)
-            segment_offset = segment_pos - segment_index
-            
-            # Get the two colors to interpolate between
-            color1 = gradient_colors[segment_index]
-            color2 = gradient_colors[segment_index + 1]
-            
-            # Linear interpolation between colors
-            r = int(color1[0] + segment_offset * (color2[0] - color1[0]))
-            g = int(color1[1] + segment_offset * (color2[1] - color1[1]))
-            b = int(color1[2] + segment_offset * (color2[2] - color1[2]))
-            
-            # Convert to FL Studio color format (0xBBGGRR)
-            color = (b << 16) | (g << 8) | r
-            channels.setChannelColor(channel_idx, color)
+        # Sample the preset's lookup table instead of interpolating per channel
+        lut = _get_gradient_lut(preset_index)
+        last = GRADIENT_LUT_SIZE - 1
+        span = max(1, total_to_color - 1)
+        colors = [lut[i * last // span] for i in range(total_to_color)]
+        apply_colors(channels_to_color, colors)
         
-        preset_names = ["Sunset", "Ocean", "Forest", "Fire", "Neon"]
-        preset_name = preset_names[preset_index]
+        preset_name = _GRADIENT_NAMES[preset_index]
         
         return {"success": True, "count": total_to_color, "preset": preset_name}
     except Exception as e: